@@ -10,6 +10,7 @@ import logging
 
 import caffe
 import h5py
+import numpy as np
 
 logging.getLogger().setLevel(logging.INFO)
 logging.basicConfig(format='%(asctime)s.%(msecs).03d: %(message)s',
@@ -25,6 +26,55 @@ MODEL_PROTOTXT = './vgg_ft_deploy_fc7_to_labels.prototxt'
 
 FC7_FEATURE_DIM = 4096
 
+# Maximum number of feature rows passed to a single forward pass.
+DEFAULT_BATCH_SIZE = 1024
+
+
+def memmap_dataset(dataset):
+    """Return a read-only memmap of an HDF5 dataset, if possible.
+
+    This only works for contiguous, uncompressed datasets, whose data lives at
+    a fixed offset in the HDF5 file.
+
+    Returns:
+        features (np.memmap or None): None if the dataset cannot be mapped.
+    """
+    if dataset.chunks is not None or dataset.compression is not None:
+        return None
+    offset = dataset.id.get_offset()
+    if offset is None:  # Storage has not been allocated.
+        return None
+    return np.memmap(dataset.file.filename, mode='r', dtype=dataset.dtype,
+                     offset=offset, shape=dataset.shape)
+
+
+def iter_feature_batches(dataset, batch_size=DEFAULT_BATCH_SIZE):
+    """Yield contiguous slices of an HDF5 features dataset.
+
+    Contiguous datasets are sliced from a memmap without copying. Chunked or
+    compressed datasets are read in slices aligned to the chunk boundaries, so
+    that each chunk is decompressed only once.
+
+    Args:
+        dataset (h5py.Dataset): (num_datapoints, feature_dimension) dataset.
+        batch_size (int): Maximum number of rows per slice. For chunked
+            datasets, this is rounded down to a multiple of the chunk size
+            (but is at least one chunk).
+
+    Yields:
+        start (int): Index of the first row in the slice.
+        features ((<=batch_size, feature_dimension) array)
+    """
+    num_rows = dataset.shape[0]
+    features = memmap_dataset(dataset)
+    if features is None:
+        features = dataset
+        if dataset.chunks is not None:
+            chunk_rows = dataset.chunks[0]
+            batch_size = max(batch_size // chunk_rows, 1) * chunk_rows
+    for start in range(0, num_rows, batch_size):
+        yield start, features[start:start + batch_size]
+
 
 def predict_action_probabilities(net, fc7_features):
     """
@@ -49,6 +99,7 @@ def predict_action_probabilities(net, fc7_features):
 
 def main():
     net = caffe.Net(MODEL_PROTOTXT, MODEL_CAFFEMODEL, caffe.TEST)
+    num_classes = net.blobs['prob'].data.shape[1]
     with h5py.File(args.fc7_features, 'r') as features_file, h5py.File(
             args.output_hdf5, 'w') as output_file:
         for crop_index in CROP_INDICES.values():
@@ -56,8 +107,14 @@ def main():
                          ORDERED_CROPS[int(crop_index)])
             output_file.create_group(crop_index)
             for filename, features in features_file[crop_index].items():
-                predictions = predict_action_probabilities(net, features)
-                output_file[crop_index][filename] = predictions
+                predictions = output_file[crop_index].create_dataset(
+                    filename, (features.shape[0], num_classes),
+                    dtype=np.float32)
+                for start, batch_features in iter_feature_batches(
+                        features, args.batch_size):
+                    end = start + batch_features.shape[0]
+                    predictions[start:end] = predict_action_probabilities(
+                        net, batch_features)
 
 
 if __name__ == '__main__':
@@ -72,6 +129,13 @@ if __name__ == '__main__':
                             [crop] should range from 0-5, corresponding to crops
                             {crops}""".format(crops=ORDERED_CROPS))
     parser.add_argument('output_hdf5')
+    parser.add_argument(
+        '--batch_size',
+        default=DEFAULT_BATCH_SIZE,
+        type=int,
+        help="""Maximum number of frames to read and predict on at once. For
+                chunked HDF5 datasets, this is rounded down to a multiple of
+                the chunk size.""")
 
     args = parser.parse_args()
 
@@ -1,47 +1,132 @@
-"""Split MultiTHUMOS annotations into val and test for evaluation."""
+"""Split MultiTHUMOS annotations into val and test for evaluation.
+
+Each annotation file is streamed line by line; every line is routed to the
+output split whose video name prefix it matches. Annotation files are
+processed in parallel.
+"""
 
 import argparse
 import os
+from collections import OrderedDict
+from multiprocessing.pool import ThreadPool
 from os import path
 
+DEFAULT_SPLIT_PREFIXES = ['video_validation_:val', 'video_test_:test']
 
-if __name__ == '__main__':
+
+def parse_split_prefix(prefix_spec):
+    """Parse a '<prefix>:<split>' specification.
+
+    >>> parse_split_prefix('video_validation_:val')
+    ('video_validation_', 'val')
+    """
+    prefix, separator, split = prefix_spec.rpartition(':')
+    if not separator or not prefix or not split:
+        raise argparse.ArgumentTypeError(
+            'Expected <prefix>:<split>, received %s' % prefix_spec)
+    return (prefix, split)
+
+
+def validate_annotation_line(line, annotation_file, line_number):
+    """Check that an annotation line has valid start and end timestamps.
+
+    Lines are of the form '<video_name> <start_seconds> <end_seconds>'.
+    """
+    fields = line.split()
+    try:
+        start_seconds, end_seconds = float(fields[1]), float(fields[2])
+    except (IndexError, ValueError):
+        raise ValueError('Invalid timestamps at %s:%d: %s' %
+                         (annotation_file, line_number, line.rstrip()))
+    if start_seconds < 0 or end_seconds < start_seconds:
+        raise ValueError('Invalid interval [%s, %s] at %s:%d' %
+                         (start_seconds, end_seconds, annotation_file,
+                          line_number))
+
+
+def split_annotation_file(annotation_file, prefix_splits, output_dirs):
+    """Stream lines of annotation_file into one output file per split.
+
+    Args:
+        annotation_file (str): Path to MultiTHUMOS annotation file.
+        prefix_splits (list of (str, str) tuples): Maps video name prefixes to
+            split names. The first matching prefix is used.
+        output_dirs (dict): Maps split name to output directory.
+    """
+    filename = path.splitext(path.basename(annotation_file))[0]
+    output_files = {}
+    try:
+        for split, output_dir in output_dirs.items():
+            output_files[split] = open(
+                path.join(output_dir, '%s_%s.txt' % (filename, split)), 'wb')
+        with open(annotation_file) as f:
+            for line_number, line in enumerate(f, 1):
+                video_filename = line.split(' ', 1)[0]
+                for prefix, split in prefix_splits:
+                    if video_filename.startswith(prefix):
+                        break
+                else:
+                    raise ValueError('Unknown file split %s' % video_filename)
+                validate_annotation_line(line, annotation_file, line_number)
+                output_files[split].write(line)
+    finally:
+        for output_file in output_files.values():
+            output_file.close()
+
+
+def main():
     parser = argparse.ArgumentParser(
         description=__doc__,
         formatter_class=argparse.ArgumentDefaultsHelpFormatter)
     parser.add_argument('multithumos_annotations_dir')
     parser.add_argument('output_dir')
+    parser.add_argument(
+        '--split_prefix',
+        action='append',
+        type=parse_split_prefix,
+        help="""Route lines whose video name starts with <prefix> to <split>,
+                specified as <prefix>:<split>. May be repeated; the first
+                matching prefix is used. Defaults to {}.""".format(
+                    DEFAULT_SPLIT_PREFIXES))
+    parser.add_argument(
+        '--num_workers',
+        default=8,
+        type=int,
+        help='Number of annotation files to process in parallel.')
 
     args = parser.parse_args()
+    prefix_splits = args.split_prefix
+    if prefix_splits is None:
+        prefix_splits = [parse_split_prefix(x) for x in DEFAULT_SPLIT_PREFIXES]
+
     root = args.multithumos_annotations_dir
     annotation_files = [path.join(root, x)
                         for x in os.listdir(root) if x.endswith('.txt')]
 
-    val_dir = path.join(args.output_dir, 'val')
-    test_dir = path.join(args.output_dir, 'test')
+    output_dirs = OrderedDict((split, path.join(args.output_dir, split))
+                              for _, split in prefix_splits)
     if not path.isdir(args.output_dir): os.mkdir(args.output_dir)
-    if not path.isdir(val_dir): os.mkdir(val_dir)
-    if not path.isdir(test_dir): os.mkdir(test_dir)
+    for output_dir in output_dirs.values():
+        if not path.isdir(output_dir): os.mkdir(output_dir)
+
+    pool = ThreadPool(args.num_workers)
+    try:
+        results = [
+            pool.apply_async(split_annotation_file,
+                             (annotation_file, prefix_splits, output_dirs))
+            for annotation_file in annotation_files
+        ]
+        for result in results:
+            # Re-raises any exception from the worker.
+            result.get()
+    finally:
+        pool.close()
+        pool.join()
 
-    for annotation_file in annotation_files:
-        filename = path.splitext(path.basename(annotation_file))[0]
-        validation_lines = []
-        test_lines = []
-        with open(annotation_file) as f:
-            for line in f:
-                video_filename = line.split(' ')[0]
-                if video_filename.startswith('video_validation_'):
-                    validation_lines.append(line)
-                elif video_filename.startswith('video_test_'):
-                    test_lines.append(line)
-                else:
-                    raise ValueError('Unknown file split %s' % video_filename)
-        validation_output_file = path.join(val_dir, filename + '_val.txt')
-        test_output_file = path.join(test_dir, filename + '_test.txt')
-        with open(validation_output_file, 'wb') as f:
-            f.writelines(validation_lines)
-        with open(test_output_file, 'wb') as f:
-            f.writelines(test_lines)
     # Create empty ambigious files which the THUMOS eval script looks for.
-    open(path.join(test_dir, 'Ambiguous_test.txt'), 'w').close()
-    open(path.join(val_dir, 'Ambiguous_val.txt'), 'w').close()
+    for split, output_dir in output_dirs.items():
+        open(path.join(output_dir, 'Ambiguous_%s.txt' % split), 'w').close()
+
+
+if __name__ == '__main__':
+    main()